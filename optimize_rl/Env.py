@@ -14,6 +14,9 @@ import numpy as np
 
 from main import create_simulation
 
+MEAN_VOLATILITY = 372.3109369150782
+STD_VOLATILITY = 287.00165015363797
+
 
 class LVREnv(gym.Env):
     def __init__(self):
@@ -25,18 +28,34 @@ class LVREnv(gym.Env):
         self.observation_space = spaces.Box(
             low=0, high=1, shape=(1,), dtype=np.float32
         )  # volatility
+        self._obs_buf = np.zeros(1, dtype=np.float32)
+        self._rng = np.random.default_rng()
+
+    def seed(self, seed=None):
+        # Every episode's simulation draws from this generator
+        self._rng = np.random.default_rng(seed)
+        return [seed]
 
     def _next_observation(self):
-        mean_volatilities = 372.3109369150782
-        std_volatilities = 287.00165015363797
-        return (
-            self.sim.volatility[self.current_step] - mean_volatilities
-        ) / std_volatilities
+        # Reuse one float32 buffer for every observation; callers must copy it to keep it
+        self._obs_buf[0] = self.volatility_norm[self.current_step]
+        return self._obs_buf
+
+    def _swap(self):
+        # Before and retail swaps of the current block; its after swap takes the next action
+        price_feed = self.sim.price_feed(self.current_step)
+        volatility = self.sim.volatility.item(self.current_step)
+        self.sim.before_swap(self.current_step, price_feed, volatility)
+        self.sim.retail_swap(self.current_step, price_feed)
 
     def _take_action(self, action):
         beta = action[0]
         self.sim.liquidity_pools[2].beta = beta
-        self.sim.after_swap(self.current_step)
+        self.sim.after_swap(
+            self.current_step,
+            self.sim.price_feed(self.current_step),
+            self.sim.volatility.item(self.current_step),
+        )
 
     def step(self, action):
         # Execute one time step within the environment
@@ -46,8 +65,7 @@ class LVREnv(gym.Env):
 
         self.current_step += 1
 
-        self.sim.before_swap(self.current_step)
-        self.sim.retail_swap(self.current_step)
+        self._swap()
 
         after_tvl_dynamic, after_tvl_diamond = self._calculate_value()
 
@@ -67,12 +85,15 @@ class LVREnv(gym.Env):
     def reset(self):
         # Reset the state of the environment to an initial state
 
-        self.sim = create_simulation()
+        self.sim = create_simulation(rng=self._rng)
         self.sim.liquidity_pools[2].before_swap = None
+        self.volatility_norm = np.asarray(
+            (self.sim.volatility - MEAN_VOLATILITY) / STD_VOLATILITY,
+            dtype=np.float32,
+        )
         self.current_step = 0
 
-        self.sim.before_swap(self.current_step)
-        self.sim.retail_swap(self.current_step)
+        self._swap()
 
         return self._next_observation()
 
@@ -81,13 +102,7 @@ class LVREnv(gym.Env):
         pass
 
     def _calculate_value(self):
-        tvl_of_dynamic_beta = self.sim.liquidity_pools[2].total_value_locked(
-            self.sim.oracle[self.current_step]
-        )
-        tvl_of_diamond = self.sim.liquidity_pools[1].total_value_locked(
-            self.sim.oracle[self.current_step]
-        )
-        tvl_of_cfmm = self.sim.liquidity_pools[0].total_value_locked(
-            self.sim.oracle[self.current_step]
-        )
+        price_feed = self.sim.price_feed(self.current_step)
+        tvl_of_dynamic_beta = self.sim.liquidity_pools[2].total_value_locked(price_feed)
+        tvl_of_diamond = self.sim.liquidity_pools[1].total_value_locked(price_feed)
         return tvl_of_dynamic_beta, tvl_of_diamond
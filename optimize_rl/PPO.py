@@ -253,7 +253,8 @@ class PPO:
     def select_action(self, state):
         if self.has_continuous_action_space:
             with torch.no_grad():
-                state = torch.FloatTensor([state]).to(device)
+                # Copy, since the env reuses its observation buffer between steps
+                state = torch.tensor(state, dtype=torch.float32).to(device)
                 action, action_logprob, state_val = self.policy_old.act(state)
 
             self.buffer.states.append(state)
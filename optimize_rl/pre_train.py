@@ -5,7 +5,7 @@ import torch.optim as optim
 import numpy as np
 from numpy import random as rn
 import matplotlib.pyplot as plt
-from PPO import ScaleToRange
+from PPO import ScaleToRange, device
 
 
 # PyTorch 모델 정의
@@ -36,8 +36,9 @@ def findPctToReAdd(volatility):
 
 
 # 데이터 준비
-x = np.arange(0, 1, 0.001)
-y = np.array([findPctToReAdd(volatility) for volatility in x])
+# float32 so torch.from_numpy(...).float() does not need to cast
+x = np.arange(0, 1, 0.001, dtype=np.float32)
+y = findPctToReAdd(x).astype(np.float32)
 # x = np.linspace(-10, 10, 100)
 # y = 3 * np.sin(x) * np.cos(x) * (6 * x**2 + 3 * x**3 + x**1) * np.tan(x)
 
@@ -57,31 +58,62 @@ pre_trained_model = nn.Sequential(
 )
 
 
+NUM_EPOCHS = 300
+BATCH_SIZE = 64
+
+
 def pretrain():
     # 모델, 손실 함수, 옵티마이저 설정
     # model = PreTrainedActor()
 
     criterion = nn.MSELoss()
     # optimizer = optim.RMSprop(model.parameters(), lr=0.001, alpha=0.9, eps=1e-08)
-    optimizer = optim.Adam(pre_trained_model.parameters(), lr=0.001)
-
-    # 학습 과정
-    for epoch in range(3000):
-        optimizer.zero_grad()
-
-        # numpy 배열을 PyTorch 텐서로 변환
-        inputs = torch.from_numpy(x).float().view(-1, 1)
-        targets = torch.from_numpy(y).float().view(-1, 1)
+    pre_trained_model.to(device)
+    optimizer = optim.Adam(pre_trained_model.parameters(), lr=0.003)
 
-        # outputs = model(inputs)
-        outputs = pre_trained_model(inputs)
-        loss = criterion(outputs, targets)
+    # Batch shapes never change (full batches plus one tail), so compile static-shape graphs.
+    # Train through the compiled wrapper but return the original module,
+    # whose state_dict keys match the PPO actor.
+    compiled_model = torch.compile(
+        pre_trained_model, mode="reduce-overhead", dynamic=False
+    )
 
-        loss.backward()
-        optimizer.step()
+    # numpy 배열을 PyTorch 텐서로 변환
+    inputs = torch.from_numpy(x).float().view(-1, 1).to(device)
+    targets = torch.from_numpy(y).float().view(-1, 1).to(device)
 
-        if epoch % 100 == 0:
-            print(f"Epoch {epoch+1}/3000, Loss: {loss.item()}")
+    # 학습 과정
+    num_samples = len(inputs)
+    for epoch in range(NUM_EPOCHS):
+        idx = torch.randperm(num_samples, device=device)
+        # Summed on the device, weighted by batch size, so the epoch syncs only once
+        loss_sum = torch.zeros((), device=device)
+        for start in range(0, num_samples, BATCH_SIZE):
+            batch_idx = idx[start : start + BATCH_SIZE]
+
+            optimizer.zero_grad(set_to_none=True)
+
+            # BF16 autocast on GPU; the optimizer keeps FP32 master weights
+            with torch.autocast(
+                device_type=device.type,
+                dtype=torch.bfloat16,
+                enabled=device.type == "cuda",
+            ):
+                # outputs = model(inputs)
+                outputs = compiled_model(inputs[batch_idx])
+                loss = criterion(outputs, targets[batch_idx])
+
+            loss.backward()
+            optimizer.step()
+
+            loss_sum += loss.detach() * len(batch_idx)
+
+        # Mean loss over the whole dataset, not just the last (tail) minibatch
+        epoch_loss = loss_sum.item() / num_samples
+        if epoch % 10 == 0:
+            print(f"Epoch {epoch+1}/{NUM_EPOCHS}, Loss: {epoch_loss}")
+        if epoch_loss < 1e-7:
+            break
 
     return pre_trained_model
 
@@ -91,7 +123,9 @@ if __name__ == "__main__":
 
     # 예측 및 시각화
     with torch.no_grad():
-        predicted = model(torch.from_numpy(x).float().view(-1, 1)).numpy()
+        predicted = (
+            model(torch.from_numpy(x).float().view(-1, 1).to(device)).cpu().numpy()
+        )
     plt.plot(x, y, label="Original")
     plt.plot(x, predicted, label="Predicted")
     plt.legend()
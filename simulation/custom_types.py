@@ -1,10 +1,34 @@
-from enum import Enum
+from enum import IntEnum
+from typing import NamedTuple
 
+import numpy as np
 
-class Token(Enum):
-    ETH = "ETH"
-    USDC = "USDC"
 
+class Token(IntEnum):
+    ETH = 0
+    USDC = 1
 
-PriceFeed = dict[Token, float]
-Oracle = list[PriceFeed]
+
+class PriceFeed(NamedTuple):
+    """
+    The oracle prices of one block, one field per Token in Token order, so it can also be indexed by Token.
+    """
+
+    eth: float
+    usdc: float
+
+
+# The oracle is an (N, 2) array of prices, one column per Token
+Oracle = np.ndarray
+
+
+class PoolArrays(NamedTuple):
+    """
+    The reserves of several pools gathered into one array per field, one entry per pool.
+    Pools without a vault have zero vault reserves.
+    """
+
+    reserve_x: np.ndarray
+    reserve_y: np.ndarray
+    vault_x: np.ndarray
+    vault_y: np.ndarray
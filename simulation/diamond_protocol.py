@@ -1,8 +1,89 @@
-from math import sqrt
-
 from custom_types import PriceFeed
 from pool import LiquidityPool, DiamondPool
-from strategy import compute_profit_maximizing_trade
+from strategy import _arb_kernel
+from jit import njit
+
+
+@njit(cache=True)
+def _core_protocol_kernel(
+    reserve_x,
+    reserve_y,
+    vault_x,
+    vault_y,
+    fee,
+    beta,
+    price_x,
+    price_y,
+    tx_fee_per_eth,
+):
+    """
+    Returns (executed, reserve_x, reserve_y, vault_x, vault_y, lvr, swap_fee, volume).
+    """
+    # Shared subexpressions, computed once
+    target_price = price_x / price_y
+    one_minus_beta = 1 - beta
+    tx_fee = tx_fee_per_eth * target_price
+
+    # Compute the profit-maximizing trade
+    x_to_y, arb_amount = _arb_kernel(reserve_x, reserve_y, fee, price_x, price_y)
+
+    if arb_amount == 0.0:
+        return False, reserve_x, reserve_y, vault_x, vault_y, 0.0, 0.0, 0.0
+
+    # Express the trade in terms of the token sent in and the token taken out,
+    # so both directions share one arithmetic sequence
+    if x_to_y:  # arbitrageur sells token_x and buys token_y
+        reserve_in, reserve_out, vault_out = reserve_x, reserve_y, vault_y
+        price_in, price_out = price_x, price_y
+        # reserve_out per unit of reserve_in at the target price
+        out_per_in = target_price
+    else:  # arbitrageur buys token_x and sells token_y
+        reserve_in, reserve_out, vault_out = reserve_y, reserve_x, vault_x
+        price_in, price_out = price_y, price_x
+        out_per_in = 1.0 / target_price
+
+    amount_in_with_fee = arb_amount * (1 - fee)
+    delta_in = arb_amount
+    delta_out = -amount_in_with_fee * reserve_out / (reserve_in + amount_in_with_fee)
+    swap_fee = arb_amount * price_in * fee
+
+    target_reserve_out = reserve_out + delta_out
+
+    swap_fee *= one_minus_beta
+    lp_loss_vs_cex = (
+        -1 * one_minus_beta * (delta_in * price_in + delta_out * price_out)
+    ) + swap_fee
+    arbitrageur_profit = lp_loss_vs_cex - swap_fee - tx_fee
+
+    if arbitrageur_profit <= 0:
+        return False, reserve_x, reserve_y, vault_x, vault_y, 0.0, 0.0, 0.0
+
+    # take beta portion of the swap taken from the arbitrageur to the vault
+    vault_out += abs(delta_out) * beta
+    # pool reserve of the token sent in is increased by the delta_in * (1 - beta)
+    reserve_in += delta_in * one_minus_beta
+    # pool reserve of the token taken out is set with the target_price
+    reserve_out = reserve_in * out_per_in
+    # excess of the token taken out is moved to the vault
+    vault_out += target_reserve_out - reserve_out
+
+    volume = abs(delta_out) * price_out
+
+    if x_to_y:
+        reserve_x, reserve_y, vault_y = reserve_in, reserve_out, vault_out
+    else:
+        reserve_y, reserve_x, vault_x = reserve_in, reserve_out, vault_out
+
+    return (
+        True,
+        reserve_x,
+        reserve_y,
+        vault_x,
+        vault_y,
+        lp_loss_vs_cex,
+        swap_fee,
+        volume,
+    )
 
 
 def core_protocol(pool: DiamondPool, price_feed: PriceFeed, tx_fee_per_eth: float):
@@ -16,61 +97,59 @@ def core_protocol(pool: DiamondPool, price_feed: PriceFeed, tx_fee_per_eth: floa
         price_feed (PriceFeed): The price feed for the pool.
         tx_fee_per_gas (float): The transaction fee per eth.
     """
-    beta = pool.beta
     token_x, token_y = pool.token_x, pool.token_y
-    target_price = price_feed[token_x] / price_feed[token_y]
-    tx_fee = tx_fee_per_eth * target_price
 
-    # Compute the profit-maximizing trade
-    x_to_y, arb_amount = compute_profit_maximizing_trade(
-        price_feed[token_x], price_feed[token_y], pool
+    (
+        executed,
+        reserve_x,
+        reserve_y,
+        vault_x,
+        vault_y,
+        lp_loss_vs_cex,
+        swap_fee,
+        volume,
+    ) = _core_protocol_kernel(
+        pool.reserve_x,
+        pool.reserve_y,
+        pool.vault.reserve_x,
+        pool.vault.reserve_y,
+        pool.fee,
+        pool.beta,
+        price_feed[token_x],
+        price_feed[token_y],
+        tx_fee_per_eth,
     )
 
-    if x_to_y:
-        delta_x = arb_amount
-        delta_y = -pool.get_amount_out(token_x, arb_amount)
-        swap_fee = arb_amount * price_feed[token_x] * pool.fee
-    else:
-        delta_x = -pool.get_amount_out(token_y, arb_amount)
-        delta_y = arb_amount
-        swap_fee = arb_amount * price_feed[token_y] * pool.fee
+    if executed:
+        pool.reserve_x = reserve_x
+        pool.reserve_y = reserve_y
+        pool.vault.reserve_x = vault_x
+        pool.vault.reserve_y = vault_y
 
-    target_reserve_x = pool.reserve_x + delta_x
-    target_reserve_y = pool.reserve_y + delta_y
+        pool.volume_arbitrage += volume
+        pool.lvr += lp_loss_vs_cex  # account without swap fees and tx fees
+        pool.collected_fees_arbitrage += swap_fee
 
-    swap_fee *= 1 - beta
-    lp_loss_vs_cex = (
-        -1
-        * (1 - beta)
-        * (delta_x * price_feed[token_x] + delta_y * price_feed[token_y])
-    ) + swap_fee
-    arbitrageur_profit = lp_loss_vs_cex - swap_fee - tx_fee
 
-    if arbitrageur_profit > 0:
-        if x_to_y:  # arbitrageur sells token_x and buys token_y
-            # take beta portion of the swap taken from the arbitrageur to the vault
-            pool.vault.reserve[token_y] += abs(delta_y) * beta
-            # pool reserve of token_x is increased by the delta_x * (1 - beta)
-            pool.reserve[token_x] += delta_x * (1 - beta)
-            # pool reserve of token_y is set with the target_price
-            pool.reserve[token_y] = pool.reserve_x * target_price
-            # excess token_y is moved to the vault
-            pool.vault.reserve[token_y] += target_reserve_y - pool.reserve_y
-
-            pool.volume_arbitrage += abs(delta_y) * price_feed[token_y]
-        else:  # arbitrageur buys token_x and sells token_y
-            pool.vault.reserve[token_x] += abs(delta_x) * beta
-            pool.reserve[token_y] += delta_y * (1 - beta)
-            pool.reserve[token_x] = pool.reserve_y / target_price
-            pool.vault.reserve[token_x] += target_reserve_x - pool.reserve_x
-
-            pool.volume_arbitrage += abs(delta_x) * price_feed[token_x]
+@njit(cache=True)
+def _vault_rebalancing_kernel(reserve_x, reserve_y, vault_x, vault_y, target_price):
+    if vault_y < vault_x * target_price:  # Adjust Token X in the pool using the vault
+        adjust_x = vault_y / target_price
+        reserve_y += vault_y
+        reserve_x += adjust_x
+        vault_y -= vault_y
+        vault_x -= adjust_x
+    elif vault_x < vault_y / target_price:  # Adjust Token Y in the pool using the vault
+        adjust_y = vault_x * target_price
+        reserve_x += vault_x
+        reserve_y += adjust_y
+        vault_x -= vault_x
+        vault_y -= adjust_y
 
-        pool.lvr += lp_loss_vs_cex  # account without swap fees and tx fees
-        pool.collected_fees_arbitrage += swap_fee
+    return reserve_x, reserve_y, vault_x, vault_y
 
 
-def vault_rebalancing(pool: LiquidityPool, price_feed: PriceFeed):
+def vault_rebalancing(pool: LiquidityPool, target_price: float):
     """
     Adjust the reserve ratio of the liquidity pool to match the ratio specified by the price feed.
     Utilize the tokens in the pool's vault to balance the pool's reserves if necessary.
@@ -78,52 +157,65 @@ def vault_rebalancing(pool: LiquidityPool, price_feed: PriceFeed):
 
     Args:
         pool (LiquidityPool): The liquidity pool to adjust.
-        price_feed (PriceFeed): The price feed for the pool.
+        target_price (float): The oracle price of token_x in terms of token_y.
     """
-    token_x, token_y = pool.token_x, pool.token_y
-    target_price = price_feed[token_x] / price_feed[token_y]
+    (
+        pool.reserve_x,
+        pool.reserve_y,
+        pool.vault.reserve_x,
+        pool.vault.reserve_y,
+    ) = _vault_rebalancing_kernel(
+        pool.reserve_x,
+        pool.reserve_y,
+        pool.vault.reserve_x,
+        pool.vault.reserve_y,
+        target_price,
+    )
 
+
+@njit(cache=True)
+def _vault_conversion_kernel(reserve_x, reserve_y, vault_x, vault_y, target_price):
     if (
-        pool.vault.reserve_y < pool.vault.reserve_x * target_price
-    ):  # Adjust Token X in the pool using the vault
-        adjust_x = pool.vault.reserve_y / target_price
-        pool.add_liquidity(token_y, pool.vault.reserve_y)
-        pool.add_liquidity(token_x, adjust_x)
-        pool.vault.reserve[token_y] -= pool.vault.reserve_y
-        pool.vault.reserve[token_x] -= adjust_x
+        vault_x == 0 and vault_y != 0
+    ):  # Convert half of Token Y in the vault to Token X and add it to the pool
+        half_vault_reserve_y = vault_y / 2
+        reserve_x += half_vault_reserve_y / target_price
+        reserve_y += half_vault_reserve_y
+        vault_y -= vault_y
     elif (
-        pool.vault.reserve_x < pool.vault.reserve_y / target_price
-    ):  # Adjust Token Y in the pool using the vault
-        adjust_y = pool.vault.reserve_x * target_price
-        pool.add_liquidity(token_x, pool.vault.reserve_x)
-        pool.add_liquidity(token_y, adjust_y)
-        pool.vault.reserve[token_x] -= pool.vault.reserve_x
-        pool.vault.reserve[token_y] -= adjust_y
+        vault_y == 0 and vault_x != 0
+    ):  # Convert Token X in the vault to Token Y and add it to the pool
+        half_vault_reserve_x = vault_x / 2
+        reserve_y += half_vault_reserve_x * target_price
+        reserve_x += half_vault_reserve_x
+        vault_x -= vault_x
+
+    return reserve_x, reserve_y, vault_x, vault_y
 
 
-def vault_conversion(pool: LiquidityPool, price_feed: PriceFeed):
+def vault_conversion(pool: LiquidityPool, target_price: float):
     """
     Convert the tokens in the pool's vault to balance the pool's reserves.
     If one of the reserves in the pool is empty, convert the other token in the pool to fill the empty reserve.
 
     Args:
         pool (LiquidityPool): The liquidity pool to adjust.
-        price_feed (PriceFeed): The price feed for the pool.
+        target_price (float): The oracle price of token_x in terms of token_y.
     """
-    token_x, token_y = pool.token_x, pool.token_y
-    target_price = price_feed[token_x] / price_feed[token_y]
+    (
+        pool.reserve_x,
+        pool.reserve_y,
+        pool.vault.reserve_x,
+        pool.vault.reserve_y,
+    ) = _vault_conversion_kernel(
+        pool.reserve_x,
+        pool.reserve_y,
+        pool.vault.reserve_x,
+        pool.vault.reserve_y,
+        target_price,
+    )
 
-    if (
-        pool.vault.reserve_x == 0 and pool.vault.reserve_y != 0
-    ):  # Convert half of Token Y in the vault to Token X and add it to the pool
-        half_vault_reserve_y = pool.vault.reserve_y / 2
-        pool.add_liquidity(token_x, half_vault_reserve_y / target_price)
-        pool.add_liquidity(token_y, half_vault_reserve_y)
-        pool.vault.reserve[token_y] -= pool.vault.reserve_y
-    elif (
-        pool.vault.reserve_y == 0 and pool.vault.reserve_x != 0
-    ):  # Convert Token X in the vault to Token Y and add it to the pool
-        half_vault_reserve_x = pool.vault.reserve_x / 2
-        pool.add_liquidity(token_y, half_vault_reserve_x * target_price)
-        pool.add_liquidity(token_x, half_vault_reserve_x)
-        pool.vault.reserve[token_x] -= pool.vault.reserve_x
+
+_core_protocol_kernel(1.0, 1.0, 0.0, 0.0, 0.003, 0.75, 1.0, 1.0, 0.0)
+_vault_rebalancing_kernel(1.0, 1.0, 0.0, 0.0, 1.0)
+_vault_conversion_kernel(1.0, 1.0, 0.0, 0.0, 1.0)
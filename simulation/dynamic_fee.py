@@ -1,6 +1,8 @@
+import numpy as np
 from math import exp
 
-from custom_types import PriceFeed, Token
+from custom_types import Oracle, Token
+from jit import njit
 
 INITIAL_MIN_FEES = 0.1 / 100
 ALPHA1 = 3000 / 1000000
@@ -13,63 +15,71 @@ VOLUME_BETA = 0
 VOLUME_GAMMA = 0
 
 
-def time_weighted_moving_average(prices: list[float], window: int) -> list[float]:
+def _window_sums(values: np.ndarray, window: int, length: int) -> np.ndarray:
+    """
+    Sum values over each run of window consecutive entries, for the first length runs.
+    Uses a preallocated cumulative sum, so only two arrays are allocated.
+    """
+    cs = np.empty(len(values) + 1)
+    cs[0] = 0.0
+    np.cumsum(values, out=cs[1:])
+    sums = np.empty(length)
+    np.subtract(cs[window : window + length], cs[:length], out=sums)
+    return sums
+
+
+def time_weighted_moving_average(prices: np.ndarray, window: int) -> np.ndarray:
     """
     Calculate the time-weighted moving average of the price of the pool over a window of blocks.
 
     Args:
-        prices (list[float]): The price of the pool over time.
+        prices (np.ndarray): The price of the pool over time.
         window (int): The number of blocks to consider in the moving average.
 
     Returns:
-        list[float]:
+        np.ndarray: The moving average starting at each block, of length len(prices) - window.
     """
-
-    twma = [sum(prices[:window]) / window]
-    for i in range(len(prices) - window - 1):
-        next_twma = twma[i] + (prices[i + window] - prices[i]) / window
-        twma.append(next_twma)
+    twma = _window_sums(prices, window, len(prices) - window)
+    twma /= window
     return twma
 
 
 def calculate_volatility(
-    token_x: Token, token_y: Token, oracle: list[PriceFeed], window: int
-) -> list[float]:
+    token_x: Token, token_y: Token, oracle: Oracle, window: int
+) -> np.ndarray:
     """
     Calculate the volatility of the price of the pool over a window of blocks.
 
     Args:
         token_x (Token): The first token in the pool.
         token_y (Token): The second token in the pool.
-        oracle (list[PriceFeed]): The price feed for the pool.
+        oracle (Oracle): The price feed for the pool, one row per block.
         window (int): The number of blocks to consider in the volatility calculation.
 
     Returns:
-        list[float]:
+        np.ndarray: The volatility for each block, of length len(oracle) - window * 2.
     """
-    prices = [oracle[i][token_x] / oracle[i][token_y] for i in range(len(oracle))]
+    prices = oracle[:, token_x] / oracle[:, token_y]
     twma = time_weighted_moving_average(
         prices, window
     )  # [0~window-1 : len(oracle)-window ~ len(oracle)-1]
-    volatility = [
-        sum([(prices[i + window] - twma[i]) ** 2 for i in range(window)])
-        / (window * 12)
-    ]
-    for i in range(len(prices) - window * 2 - 1):
-        next_volatility = volatility[i] + (
-            (prices[i + window * 2] - twma[i + window]) ** 2
-            - (prices[i + window] - twma[i]) ** 2
-        ) / (window * 12)
-        volatility.append(next_volatility)
+
+    # Rolling sum of the squared residuals over the window, using the same cumsum trick
+    resid = prices[window : window + len(twma)] - twma
+    np.square(resid, out=resid)
+    volatility = _window_sums(resid, window, len(prices) - window * 2)
+    volatility /= window * 12
 
     return volatility
 
 
+@njit(cache=True, fastmath=True)
 def custom_sigmoid(x, alpha, gamma, beta):
-    if gamma * (beta - x) > 700:
-        return alpha / (1 + exp(700))
+    z = gamma * (beta - x)
+    if z > 700:  # Clamp to keep exp from overflowing
+        z = 700.0
 
-    return alpha / (1 + exp(gamma * (beta - x)))
+    return alpha / (1.0 + exp(z))
 
 
 # def calculate_dynamic_fee(volatility: float) -> float:
@@ -103,6 +113,7 @@ def custom_sigmoid(x, alpha, gamma, beta):
 #     return initial_min_fee + dynamic_fee
 
 
+@njit(cache=True, fastmath=True)
 def calculate_dynamic_beta(
     volatility: float,
     initial_min_beta: float = INITIAL_MIN_FEES,
@@ -135,3 +146,32 @@ def calculate_dynamic_beta(
     )
 
     return min(initial_min_beta + dynamic_beta, 0.99)
+
+
+@njit(cache=True, fastmath=True)
+def calculate_dynamic_beta_arr(volatility: float, params: np.ndarray) -> float:
+    """
+    Calculate the dynamic beta with the sigmoid parameters packed into one array.
+
+    Args:
+        volatility (float): The volatility of the price of the pool.
+        params (np.ndarray): (initial_min_beta, alpha1, alpha2, beta1, beta2, gamma1, gamma2) as float64.
+
+    Returns:
+        float: The dynamic beta for the pool.
+    """
+    return calculate_dynamic_beta(
+        volatility,
+        params[0],
+        params[1],
+        params[2],
+        params[3],
+        params[4],
+        params[5],
+        params[6],
+    )
+
+
+calculate_dynamic_beta(0.0)
+calculate_dynamic_beta(0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+calculate_dynamic_beta_arr(0.0, np.zeros(7))
@@ -0,0 +1,10 @@
+# Modules call their kernels once at import, so compilation is not paid inside the
+# simulation loop
+try:
+    from numba import njit
+except ImportError:  # numba is optional, fall back to plain Python
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
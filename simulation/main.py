@@ -1,7 +1,8 @@
 import os
-import pandas as pd
+import csv
 import numpy as np
 import time
+from concurrent.futures import ProcessPoolExecutor
 
 from custom_types import Token
 from simulator import Simulator
@@ -19,34 +20,50 @@ TX_FEE_PER_ETH = 0.009
 NEW_LIQUIDITY = V0 / 1000
 NEW_LIQUIDITY_PERIOD = 0
 
+# Dynamic beta parameters, kept as plain floats so each block passes them directly
+DYNAMIC_INITIAL_MIN_FEES = 0.01
+DYNAMIC_ALPHA1 = 0.39
+DYNAMIC_ALPHA2 = 0.012
+DYNAMIC_BETA1 = 390.0
+DYNAMIC_BETA2 = 60000.0
+DYNAMIC_GAMMA1 = 0.018518518518518517
+DYNAMIC_GAMMA2 = 0.001176470588235294
+
+NUM_POOLS = 3
+# Columns of results/result.csv, one group per pool statistic
+COLUMNS = (
+    ["Price"]
+    + [f"TVL_{i+1}" for i in range(NUM_POOLS)]
+    + [f"LVR_{i+1}" for i in range(NUM_POOLS)]
+    + [f"Collected_Fees_{i+1}" for i in range(NUM_POOLS)]
+    + [f"Collected_Fees_Retail_{i+1}" for i in range(NUM_POOLS)]
+    + [f"Collected_Fees_Arbitrage_{i+1}" for i in range(NUM_POOLS)]
+    + [f"Volume_{i+1}" for i in range(NUM_POOLS)]
+    + [f"Volume_Retail_{i+1}" for i in range(NUM_POOLS)]
+    + [f"Volume_Arbitrage_{i+1}" for i in range(NUM_POOLS)]
+    + ["Best Pool", "Best Pool TVL/CFMM"]
+)
+
 
 def diamond_after_swap(pool, price_feed, volatility, block_num):
     core_protocol(pool, price_feed, TX_FEE_PER_ETH)
 
-    vault_rebalancing(pool, price_feed)
+    target_price = price_feed[pool.token_x] / price_feed[pool.token_y]
+    vault_rebalancing(pool, target_price)
     if block_num % 10 == 0:
-        vault_conversion(pool, price_feed)
+        vault_conversion(pool, target_price)
 
 
 def dynamic_after_swap(pool, price_feed, volatility, block_num):
-    parameter = {
-        "initial_min_fees": 0.01,
-        "alpha1": 0.39,
-        "alpha2": 0.012,
-        "beta1": 390,
-        "beta2": 60000,
-        "gamma1": 0.018518518518518517,
-        "gamma2": 0.001176470588235294,
-    }
     pool.beta = calculate_dynamic_beta(
         volatility,
-        parameter["initial_min_fees"],
-        parameter["alpha1"],
-        parameter["alpha2"],
-        parameter["beta1"],
-        parameter["beta2"],
-        parameter["gamma1"],
-        parameter["gamma2"],
+        DYNAMIC_INITIAL_MIN_FEES,
+        DYNAMIC_ALPHA1,
+        DYNAMIC_ALPHA2,
+        DYNAMIC_BETA1,
+        DYNAMIC_BETA2,
+        DYNAMIC_GAMMA1,
+        DYNAMIC_GAMMA2,
     )
     diamond_after_swap(pool, price_feed, volatility, block_num)
 
@@ -60,9 +77,15 @@ def create_simulation(
     beta=0.75,
     diamond_after_swap=diamond_after_swap,
     dynamic_after_swap=dynamic_after_swap,
+    rng=None,
 ) -> Simulator:
     sim = Simulator(
-        blocks_per_day, num_days, tx_fee_per_eth, new_liquidity, new_liquidity_period
+        blocks_per_day,
+        num_days,
+        tx_fee_per_eth,
+        new_liquidity,
+        new_liquidity_period,
+        rng,
     )
 
     sim.create_liquidity_pool(Token.ETH, Token.USDC, RESERVE_X, RESERVE_Y, 0.003)
@@ -91,59 +114,69 @@ def create_simulation(
     return sim
 
 
-if __name__ == "__main__":
+def _run_one(i: int) -> dict:
+    """
+    Run simulation i with its own seed and collect its result row.
 
-    np.random.seed(123)
-
-    num_pools = 3
-
-    columns = (
-        ["Price"]
-        + [f"TVL_{i+1}" for i in range(num_pools)]
-        + [f"LVR_{i+1}" for i in range(num_pools)]
-        + [f"Collected_Fees_{i+1}" for i in range(num_pools)]
-        + [f"Collected_Fees_Retail_{i+1}" for i in range(num_pools)]
-        + [f"Collected_Fees_Arbitrage_{i+1}" for i in range(num_pools)]
-        + [f"Volume_{i+1}" for i in range(num_pools)]
-        + [f"Volume_Retail_{i+1}" for i in range(num_pools)]
-        + [f"Volume_Arbitrage_{i+1}" for i in range(num_pools)]
-        + ["Best Pool", "Best Pool TVL/CFMM"]
-    )
+    Args:
+        i (int): The index of the simulation, also used to derive its seed.
+
+    Returns:
+        dict: The result row of the simulation.
+    """
+    start_time = time.time()
+    print(f"Running simulation {i}")
+
+    # Own generator per simulation so results do not depend on how runs are scheduled
+    sim = create_simulation(rng=np.random.default_rng(123 + i))
+    sim.run(verbose=False)
+
+    last_price = sim.price_feed(-1)
+    # The snapshot already batches the TVL of every pool, so reuse it for the best pool
+    snapshot = sim.current_snapshot()
+    tvls = np.array([pool_snapshot["TVL"] for pool_snapshot in snapshot])
+
+    new_row = {}
+    new_row["Price"] = last_price[Token.ETH] / last_price[Token.USDC]
+    for j, pool_snapshot in enumerate(snapshot):
+        new_row[f"TVL_{j+1}"] = pool_snapshot["TVL"]
+        new_row[f"LVR_{j+1}"] = pool_snapshot["LVR"]
+        new_row[f"Collected_Fees_{j+1}"] = pool_snapshot["Collected Fees"]
+        new_row[f"Collected_Fees_Retail_{j+1}"] = pool_snapshot["Collected Fees Retail"]
+        new_row[f"Collected_Fees_Arbitrage_{j+1}"] = pool_snapshot[
+            "Collected Fees Arbitrage"
+        ]
+        new_row[f"Volume_{j+1}"] = pool_snapshot["Volume"]
+        new_row[f"Volume_Retail_{j+1}"] = pool_snapshot["Volume Retail"]
+        new_row[f"Volume_Arbitrage_{j+1}"] = pool_snapshot["Volume Arbitrage"]
+    best_pool = int(tvls.argmax())
+    new_row["Best Pool"] = best_pool + 1
+    new_row["Best Pool TVL/CFMM"] = tvls[best_pool] / tvls[0]
+
+    print(f"Simulation {i} took {time.time() - start_time} seconds")
+
+    return new_row
+
+
+if __name__ == "__main__":
 
-    result = pd.DataFrame(columns=columns)
-
-    for i in range(100):
-        start_time = time.time()
-        print(f"Running simulation {i}")
-
-        sim = create_simulation()
-        sim.run(verbose=False)
-
-        new_row = {}
-        new_row["Price"] = sim.oracle[-1][Token.ETH] / sim.oracle[-1][Token.USDC]
-        for j, pool_snapshot in enumerate(sim.current_snapshot()):
-            new_row[f"TVL_{j+1}"] = pool_snapshot["TVL"]
-            new_row[f"LVR_{j+1}"] = pool_snapshot["LVR"]
-            new_row[f"Collected_Fees_{j+1}"] = pool_snapshot["Collected Fees"]
-            new_row[f"Collected_Fees_Retail_{j+1}"] = pool_snapshot[
-                "Collected Fees Retail"
-            ]
-            new_row[f"Collected_Fees_Arbitrage_{j+1}"] = pool_snapshot[
-                "Collected Fees Arbitrage"
-            ]
-            new_row[f"Volume_{j+1}"] = pool_snapshot["Volume"]
-            new_row[f"Volume_Retail_{j+1}"] = pool_snapshot["Volume Retail"]
-            new_row[f"Volume_Arbitrage_{j+1}"] = pool_snapshot["Volume Arbitrage"]
-        tvls = [pool.total_value_locked(sim.oracle[-1]) for pool in sim.liquidity_pools]
-        best_pool = tvls.index(max(tvls))
-        new_row["Best Pool"] = best_pool + 1
-        new_row["Best Pool TVL/CFMM"] = tvls[best_pool] / tvls[0]
-
-        result = pd.concat([result, pd.DataFrame([new_row])], ignore_index=True)
-
-        print(f"Simulation {i} took {time.time() - start_time} seconds")
-
-    if not os.path.exists("results"):
-        os.makedirs("results")
-
-    result.to_csv("results/result.csv")
+    os.makedirs("results", exist_ok=True)
+
+    # Stream each row to disk as soon as it arrives instead of holding all runs
+    with open("results/result.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+
+        # Simulations are independent, so run them on all cores
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for row in executor.map(_run_one, range(100)):
+                # Every column but the pool number is a float, so write those compactly
+                writer.writerow(
+                    {
+                        column: (
+                            value if column == "Best Pool" else f"{float(value):.10g}"
+                        )
+                        for column, value in row.items()
+                    }
+                )
+                f.flush()
@@ -2,11 +2,14 @@ import os
 import pandas as pd
 import numpy as np
 import time
+import itertools
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 from custom_types import Token
 from simulator import Simulator
 from diamond_protocol import core_protocol, vault_rebalancing, vault_conversion
-from dynamic_fee import calculate_dynamic_beta
+from dynamic_fee import calculate_dynamic_beta_arr
 
 # assume 12 second blocks as in the mainnet
 BLOCKS_PER_DAY = 86400 // 12
@@ -23,15 +26,21 @@ NEW_LIQUIDITY_PERIOD = 0
 def diamond_after_swap(pool, price_feed, volatility, block_num):
     core_protocol(pool, price_feed, TX_FEE_PER_ETH)
 
-    vault_rebalancing(pool, price_feed)
+    target_price = price_feed[pool.token_x] / price_feed[pool.token_y]
+    vault_rebalancing(pool, target_price)
     if block_num % 10 == 0:
-        vault_conversion(pool, price_feed)
+        vault_conversion(pool, target_price)
 
 
 def dynamic_after_swap(pool, price_feed, volatility, block_num):
     pass
 
 
+def _dynamic_after_swap(pool, price_feed, volatility, block_num, *, params):
+    pool.beta = calculate_dynamic_beta_arr(volatility, params)
+    diamond_after_swap(pool, price_feed, volatility, block_num)
+
+
 def create_simulation(
     blocks_per_day=BLOCKS_PER_DAY,
     num_days=NUM_DAYS,
@@ -41,9 +50,15 @@ def create_simulation(
     beta=0.75,
     diamond_after_swap=diamond_after_swap,
     dynamic_after_swap=dynamic_after_swap,
+    rng=None,
 ) -> Simulator:
     sim = Simulator(
-        blocks_per_day, num_days, tx_fee_per_eth, new_liquidity, new_liquidity_period
+        blocks_per_day,
+        num_days,
+        tx_fee_per_eth,
+        new_liquidity,
+        new_liquidity_period,
+        rng,
     )
 
     sim.create_liquidity_pool(Token.ETH, Token.USDC, RESERVE_X, RESERVE_Y, 0.003)
@@ -72,6 +87,55 @@ def create_simulation(
     return sim
 
 
+def evaluate_params(params: tuple) -> float:
+    """
+    Evaluate one set of dynamic beta parameters over 10 simulations.
+
+    Args:
+        params (tuple): (initial_min_fees, alpha1, alpha2, beta1, beta2, gamma1, gamma2).
+
+    Returns:
+        float: The mean TVL ratio of the dynamic beta pool to the diamond pool.
+    """
+    # Plain floats print without the numpy scalar type
+    initial_min_fees, alpha1, alpha2, beta1, beta2, gamma1, gamma2 = map(float, params)
+    print(
+        f"Running simulation with parameters: {initial_min_fees}, {alpha1}, {alpha2}, {beta1}, {beta2}, {gamma1}, {gamma2}"
+    )
+    start_time = time.time()
+
+    # Pack the parameters once, so each block passes a single float64 array
+    custom_dynamic_after_swap = partial(
+        _dynamic_after_swap,
+        params=np.array(
+            [initial_min_fees, alpha1, alpha2, beta1, beta2, gamma1, gamma2],
+            dtype=np.float64,
+        ),
+    )
+
+    # Fresh entropy per call, so forked workers do not repeat each other's runs
+    rng = np.random.default_rng()
+    tvl_ratio = np.empty(10)
+    for i in range(10):
+        sim = create_simulation(dynamic_after_swap=custom_dynamic_after_swap, rng=rng)
+        sim.run(verbose=False)
+        last_price = sim.price_feed(-1)
+        tvl_ratio[i] = sim.liquidity_pools[2].total_value_locked(
+            last_price
+        ) / sim.liquidity_pools[1].total_value_locked(last_price)
+
+    print(f"Simulation took {time.time() - start_time} seconds")
+    return float(tvl_ratio.mean())
+
+
+def _row_keys(rows: np.ndarray) -> np.ndarray:
+    """
+    View each row of a 2-D array as one opaque value, so whole rows can be compared with np.isin.
+    """
+    rows = np.ascontiguousarray(rows)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+
+
 if __name__ == "__main__":
 
     num_pools = 3
@@ -84,26 +148,21 @@ if __name__ == "__main__":
     range_gamma1 = [1 / 54, 1 / 59, 1 / 64]
     range_gamma2 = [1 / 85000, 1 / 8500, 1 / 850]
 
-    # Make parameter set
-    parameters = []
-    for initial_min_fees in range_initial_min_fees:
-        for alpha1 in range_alpha1:
-            for alpha2 in range_alpha2:
-                for beta1 in range_beta1:
-                    for beta2 in range_beta2:
-                        for gamma1 in range_gamma1:
-                            for gamma2 in range_gamma2:
-                                parameters.append(
-                                    (
-                                        initial_min_fees,
-                                        alpha1,
-                                        alpha2,
-                                        beta1,
-                                        beta2,
-                                        gamma1,
-                                        gamma2,
-                                    )
-                                )
+    # Make parameter set, one row per combination
+    parameters = np.array(
+        list(
+            itertools.product(
+                range_initial_min_fees,
+                range_alpha1,
+                range_alpha2,
+                range_beta1,
+                range_beta2,
+                range_gamma1,
+                range_gamma2,
+            )
+        ),
+        dtype=np.float64,
+    )
 
     # Shuffle parameter set
     np.random.shuffle(parameters)
@@ -120,11 +179,11 @@ if __name__ == "__main__":
         "tvl_ratio": 0,
     }
 
-    if not os.path.exists("results"):
-        os.makedirs("results")
+    os.makedirs("results", exist_ok=True)
 
-    if not os.path.exists("results/optimize.csv"):
-        log_f = open("results/optimize.csv", "w")
+    # Line buffered, so every logged result reaches disk as soon as it is written
+    log_f = open("results/optimize.csv", "a", buffering=1)
+    if os.path.getsize("results/optimize.csv") == 0:
         log_f.write(
             "initial_min_fees,alpha1,alpha2,beta1,beta2,gamma1,gamma2,tvl_ratio\n"
         )
@@ -142,65 +201,59 @@ if __name__ == "__main__":
                 "gamma1",
                 "gamma2",
             ]
-        ].values
+        ].to_numpy(dtype=np.float64)
         print("Tested parameters:", len(tested_parameters))
-        tested_parameters_tuples = [tuple(row) for row in tested_parameters]
-        parameters = [p for p in parameters if tuple(p) not in tested_parameters_tuples]
+        # Round both sides so values that drifted in the CSV round trip still match
+        parameters = parameters[
+            ~np.isin(
+                _row_keys(np.round(parameters, 12)),
+                _row_keys(np.round(tested_parameters, 12)),
+            )
+        ]
         print("Remaining parameters to test:", len(parameters))
         best_result = df.iloc[df["tvl_ratio"].idxmax()].to_dict()
         print(f"Best result so far: {best_result}")
-        log_f = open("results/optimize.csv", "a")
 
-    while len(parameters) > 0:
-        # Choose parameter set Randomly
-        initial_min_fees, alpha1, alpha2, beta1, beta2, gamma1, gamma2 = parameters.pop(
-            0
-        )
-        print(
-            f"Running simulation with parameters: {initial_min_fees}, {alpha1}, {alpha2}, {beta1}, {beta2}, {gamma1}, {gamma2}"
-        )
-        start_time = time.time()
-
-        def custom_dynamic_after_swap(pool, price_feed, volatility, block_num):
-            pool.beta = calculate_dynamic_beta(
-                volatility,
-                initial_min_fees,
-                alpha1,
-                alpha2,
-                beta1,
-                beta2,
-                gamma1,
-                gamma2,
-            )
-            diamond_after_swap(pool, price_feed, volatility, block_num)
-
-        tvl_ratio = []
-        for i in range(10):
-            sim = create_simulation(dynamic_after_swap=custom_dynamic_after_swap)
-            sim.run(verbose=False)
-            tvl_ratio.append(
-                sim.liquidity_pools[2].total_value_locked(sim.oracle[-1])
-                / sim.liquidity_pools[1].total_value_locked(sim.oracle[-1])
-            )
+    # Parameter sets are independent, so evaluate them on all cores and log each
+    # result in this process as soon as it is ready. Only one parameter set per worker
+    # is in flight, so an interrupt stops the search as soon as the running ones finish
+    # and a restart resumes from the log.
+    max_workers = os.cpu_count()
+    pending_parameters = iter(parameters)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(evaluate_params, tuple(params)): params
+            for params in itertools.islice(pending_parameters, max_workers)
+        }
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                params = futures.pop(future)
+                next_params = next(pending_parameters, None)
+                if next_params is not None:
+                    futures[executor.submit(evaluate_params, tuple(next_params))] = (
+                        next_params
+                    )
 
-        print(f"Simulation took {time.time() - start_time} seconds")
-        print(f"TVL ratio: {np.mean(tvl_ratio)}")
-        log_f.write(
-            f"{initial_min_fees}, {alpha1}, {alpha2}, {beta1}, {beta2}, {gamma1}, {gamma2}, {np.mean(tvl_ratio)}\n"
-        )
-        log_f.flush()
-
-        if np.mean(tvl_ratio) > best_result["tvl_ratio"]:
-            best_result = {
-                "initial_min_fees": initial_min_fees,
-                "alpha1": alpha1,
-                "alpha2": alpha2,
-                "beta1": beta1,
-                "beta2": beta2,
-                "gamma1": gamma1,
-                "gamma2": gamma2,
-                "tvl_ratio": np.mean(tvl_ratio),
-            }
-        print(f"Best result: {best_result}")
+                initial_min_fees, alpha1, alpha2, beta1, beta2, gamma1, gamma2 = params
+                tvl_ratio = future.result()
+
+                print(f"TVL ratio: {tvl_ratio}")
+                log_f.write(
+                    f"{initial_min_fees}, {alpha1}, {alpha2}, {beta1}, {beta2}, {gamma1}, {gamma2}, {tvl_ratio}\n"
+                )
+
+                if tvl_ratio > best_result["tvl_ratio"]:
+                    best_result = {
+                        "initial_min_fees": initial_min_fees,
+                        "alpha1": alpha1,
+                        "alpha2": alpha2,
+                        "beta1": beta1,
+                        "beta2": beta2,
+                        "gamma1": gamma1,
+                        "gamma2": gamma2,
+                        "tvl_ratio": tvl_ratio,
+                    }
+                print(f"Best result: {best_result}")
 
     log_f.close()
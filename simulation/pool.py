@@ -1,29 +1,42 @@
-from dataclasses import dataclass, field
 from math import sqrt
-from copy import deepcopy
 from typing import Optional, Callable
 
 from custom_types import Token, PriceFeed
 
 
-@dataclass
 class Vault:
+    __slots__ = ("token_x", "token_y", "reserve_x", "reserve_y")
+
     def __init__(self, token_x: Token, token_y: Token):
         self.token_x: Token = token_x
         self.token_y: Token = token_y
-        self.reserve: dict[Token, float] = {self.token_x: 0, self.token_y: 0}
-
-    @property
-    def reserve_x(self) -> float:
-        return self.reserve[self.token_x]
+        self.reserve_x: float = 0
+        self.reserve_y: float = 0
 
-    @property
-    def reserve_y(self) -> float:
-        return self.reserve[self.token_y]
+    def copy(self):
+        vault = Vault(self.token_x, self.token_y)
+        vault.reserve_x = self.reserve_x
+        vault.reserve_y = self.reserve_y
+        return vault
 
 
-@dataclass
 class LiquidityPool:
+    # Fixed attribute layout, so the hot per-block reads skip the instance dict
+    __slots__ = (
+        "token_x",
+        "token_y",
+        "_fee",
+        "_one_minus_fee",
+        "reserve_x",
+        "reserve_y",
+        "lvr",
+        "collected_fees_retail",
+        "collected_fees_arbitrage",
+        "volume_retail",
+        "volume_arbitrage",
+    )
+    pool_type = "Liquidity"
+
     def __init__(
         self,
         token_x,
@@ -33,7 +46,8 @@ class LiquidityPool:
         self.token_x: Token = token_x
         self.token_y: Token = token_y
         self.fee: float = fee
-        self.reserve: dict[Token, float] = {self.token_x: 0, self.token_y: 0}
+        self.reserve_x: float = 0
+        self.reserve_y: float = 0
         self.lvr: float = 0
         self.collected_fees_retail: float = 0
         self.collected_fees_arbitrage: float = 0
@@ -41,15 +55,38 @@ class LiquidityPool:
         self.volume_arbitrage: float = 0
 
     def copy(self):
-        return deepcopy(self)
+        # Every field is a scalar or a Token, so copying them one by one is a full copy
+        pool = self.__class__.__new__(self.__class__)
+        pool.token_x = self.token_x
+        pool.token_y = self.token_y
+        pool._fee = self._fee
+        pool._one_minus_fee = self._one_minus_fee
+        pool.reserve_x = self.reserve_x
+        pool.reserve_y = self.reserve_y
+        pool.lvr = self.lvr
+        pool.collected_fees_retail = self.collected_fees_retail
+        pool.collected_fees_arbitrage = self.collected_fees_arbitrage
+        pool.volume_retail = self.volume_retail
+        pool.volume_arbitrage = self.volume_arbitrage
+        return pool
 
     @property
-    def reserve_x(self) -> float:
-        return self.reserve[self.token_x]
+    def fee(self) -> float:
+        return self._fee
+
+    @fee.setter
+    def fee(self, fee: float):
+        # Every swap needs 1 - fee, so keep it alongside the fee
+        self._fee = fee
+        self._one_minus_fee = 1 - fee
 
     @property
-    def reserve_y(self) -> float:
-        return self.reserve[self.token_y]
+    def one_minus_fee(self) -> float:
+        return self._one_minus_fee
+
+    def vault_reserves(self) -> tuple[float, float]:
+        # Plain pools have no vault
+        return 0.0, 0.0
 
     @property
     def price(self) -> float:
@@ -61,17 +98,16 @@ class LiquidityPool:
 
     def total_value_locked(self, price_feed: PriceFeed) -> float:
         return (
-            self.reserve[self.token_x] * price_feed[self.token_x]
-            + self.reserve[self.token_y] * price_feed[self.token_y]
+            self.reserve_x * price_feed[self.token_x]
+            + self.reserve_y * price_feed[self.token_y]
         )
 
-    def other_token(self, token: Token) -> Token:
-        return self.token_x if token == self.token_y else self.token_y
-
     def get_amount_out(self, token_in: Token, amount_in: float) -> float:
-        amount_in_with_fee = amount_in * (1 - self.fee)
-        reserve_in = self.reserve[token_in]
-        reserve_out = self.reserve[self.other_token(token_in)]
+        amount_in_with_fee = amount_in * self._one_minus_fee
+        if token_in == self.token_x:
+            reserve_in, reserve_out = self.reserve_x, self.reserve_y
+        else:
+            reserve_in, reserve_out = self.reserve_y, self.reserve_x
         amount_out = (
             amount_in_with_fee * reserve_out / (reserve_in + amount_in_with_fee)
         )
@@ -89,13 +125,19 @@ class LiquidityPool:
             float: The amount of liquidity tokens minted.
         """
         # Update the reserves based on which token is being added
-        self.reserve[token] += amount
+        if token == self.token_x:
+            self.reserve_x += amount
+        else:
+            self.reserve_y += amount
 
         # Calculate the amount of liquidity tokens to mint and return it
         # return amount * self.total_supply / self.total_value_locked
 
     def remove_liquidity(self, token: Token, amount: float):
-        self.reserve[token] -= amount
+        if token == self.token_x:
+            self.reserve_x -= amount
+        else:
+            self.reserve_y -= amount
 
     def swap(self, token_in: Token, amount_in: float) -> float:
         """
@@ -108,19 +150,51 @@ class LiquidityPool:
         Returns:
             float: The amount of the other token that is swapped out.
         """
-        # Calculate the amount out using the get_amount_out method
-        amount_out = self.get_amount_out(token_in, amount_in)
+        if token_in == self.token_x:
+            return self.swap_x_for_y(amount_in)
+        return self.swap_y_for_x(amount_in)
+
+    def swap_x_for_y(self, amount_in: float) -> float:
+        """
+        Swap amount_in of token_x for token_y.
 
-        # Update the reserves based on which token is being swapped in
-        self.reserve[token_in] += amount_in
-        self.reserve[self.other_token(token_in)] -= amount_out
+        Args:
+            amount_in (float): The amount of token_x being swapped.
 
-        # Return the amount of the other token that was swapped out
+        Returns:
+            float: The amount of token_y that is swapped out.
+        """
+        amount_in_with_fee = amount_in * self._one_minus_fee
+        amount_out = (
+            amount_in_with_fee * self.reserve_y / (self.reserve_x + amount_in_with_fee)
+        )
+        self.reserve_x += amount_in
+        self.reserve_y -= amount_out
+        return amount_out
+
+    def swap_y_for_x(self, amount_in: float) -> float:
+        """
+        Swap amount_in of token_y for token_x.
+
+        Args:
+            amount_in (float): The amount of token_y being swapped.
+
+        Returns:
+            float: The amount of token_x that is swapped out.
+        """
+        amount_in_with_fee = amount_in * self._one_minus_fee
+        amount_out = (
+            amount_in_with_fee * self.reserve_x / (self.reserve_y + amount_in_with_fee)
+        )
+        self.reserve_y += amount_in
+        self.reserve_x -= amount_out
         return amount_out
 
 
-@dataclass
 class DiamondPool(LiquidityPool):
+    __slots__ = ("before_swap", "after_swap", "beta", "vault")
+    pool_type = "Diamond"
+
     def __init__(
         self,
         token_x,
@@ -136,12 +210,19 @@ class DiamondPool(LiquidityPool):
         self.beta: float = beta
         self.vault = Vault(token_x, token_y)
 
+    def copy(self):
+        pool = super().copy()
+        pool.before_swap = self.before_swap
+        pool.after_swap = self.after_swap
+        pool.beta = self.beta
+        pool.vault = self.vault.copy()
+        return pool
+
+    def vault_reserves(self) -> tuple[float, float]:
+        return self.vault.reserve_x, self.vault.reserve_y
+
     # override total_value_locked
     def total_value_locked(self, price_feed: PriceFeed) -> float:
-        return (
-            self.reserve[self.token_x] + self.vault.reserve[self.token_x]
-        ) * price_feed[self.token_x] + (
-            self.reserve[self.token_y] + self.vault.reserve[self.token_y]
-        ) * price_feed[
-            self.token_y
-        ]
+        return (self.reserve_x + self.vault.reserve_x) * price_feed[self.token_x] + (
+            self.reserve_y + self.vault.reserve_y
+        ) * price_feed[self.token_y]
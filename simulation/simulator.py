@@ -1,9 +1,9 @@
 import numpy as np
 from typing import Optional, Callable
 
-from custom_types import Token, Oracle
+from custom_types import Token, Oracle, PoolArrays, PriceFeed
 from pool import LiquidityPool, DiamondPool
-from strategy import multi_pool_random_swap, perform_arbitrage
+from strategy import draw_retail_flow, multi_pool_random_swap, perform_arbitrage
 from dynamic_fee import calculate_volatility
 
 
@@ -15,15 +15,26 @@ class Simulator:
         tx_fee_per_eth: float,
         new_liquidity: float,
         new_liquidity_period: int,
+        rng: Optional[np.random.Generator] = None,
     ):
         self.liquidity_pools: list[LiquidityPool] = []
-        self.oracle: Oracle = []
-        self.volatility: list[float] = []
+        # The same pools split by type, so the per-block hooks need no isinstance checks
+        self._plain_pools: list[LiquidityPool] = []
+        self._diamond_pools: list[DiamondPool] = []
+        self.oracle: Oracle = np.empty((0, 2))
+        self.volatility: np.ndarray = np.empty(0)
+        self.retail_num_transactions: np.ndarray = np.empty(0, dtype=np.int64)
+        self.retail_sizes: np.ndarray = np.empty(0)
+        self.px: np.ndarray = np.empty(0)
+        self.py: np.ndarray = np.empty(0)
         self.blocks_per_day: int = blocks_per_day
         self.num_days: int = num_days
         self.tx_fee_per_eth: float = tx_fee_per_eth
         self.new_liquidity: float = new_liquidity
         self.new_liquidity_period: int = new_liquidity_period
+        # Without a generator, draw from a fresh PCG64 generator; pass
+        # np.random.default_rng(seed) for a reproducible run
+        self.rng = rng if rng is not None else np.random.default_rng()
 
     def create_liquidity_pool(
         self,
@@ -39,6 +50,7 @@ class Simulator:
         liquidity_pool.add_liquidity(token_y, reserve_y)
 
         self.liquidity_pools.append(liquidity_pool)
+        self._plain_pools.append(liquidity_pool)
 
     def create_diamond_pool(
         self,
@@ -64,6 +76,7 @@ class Simulator:
         diamond_pool.add_liquidity(token_y, reserve_y)
 
         self.liquidity_pools.append(diamond_pool)
+        self._diamond_pools.append(diamond_pool)
 
     def create_oracle(self, initial_price: float, sigma_per_day: float):
         """
@@ -76,85 +89,136 @@ class Simulator:
         mu = 0.0
 
         dt = 1 / self.blocks_per_day
+        num_blocks = (self.num_days + 2) * self.blocks_per_day
 
-        price_path_eth = np.exp(
-            (mu - sigma_per_day**2 / 2) * dt
-            + sigma_per_day
-            * np.random.normal(
-                0, np.sqrt(dt), size=(self.num_days + 2) * self.blocks_per_day - 1
-            ).T
-        )
-
-        price_path_eth = np.insert(price_path_eth, 0, 1.0)
-        price_path_eth = price_path_eth.cumprod()
-        price_path_eth = (
-            price_path_eth * initial_price / price_path_eth[self.blocks_per_day * 2]
-        )
-
-        price_path_usdc = np.ones((self.num_days + 2) * self.blocks_per_day)
+        # Build the ETH path in place in its oracle column: start at 1.0, then
+        # accumulate the GBM increments, rescaled so the first simulated block
+        # (after the two warm-up days) is at initial_price
+        self.oracle = np.empty((num_blocks, 2))
+        price_path_eth = self.oracle[:, Token.ETH]
+        price_path_eth[0] = 1.0
+        increments = self.rng.standard_normal(num_blocks - 1)
+        increments *= np.sqrt(dt)
+        increments *= sigma_per_day
+        increments += (mu - sigma_per_day**2 / 2) * dt
+        np.exp(increments, out=price_path_eth[1:])
+        np.cumprod(price_path_eth, out=price_path_eth)
+        start_price = price_path_eth[self.blocks_per_day * 2]
+        price_path_eth *= initial_price
+        price_path_eth /= start_price
 
-        self.oracle = [
-            {Token.ETH: price_path_eth[i], Token.USDC: price_path_usdc[i]}
-            for i in range((self.num_days + 2) * self.blocks_per_day)
-        ]
+        self.oracle[:, Token.USDC] = 1.0
         self.volatility = calculate_volatility(
             Token.ETH, Token.USDC, self.oracle, self.blocks_per_day
         )
 
         self.oracle = self.oracle[self.blocks_per_day * 2 :]
 
-    def before_swap(self, block_num: int):
-        for pool in self.liquidity_pools:
-            if isinstance(pool, DiamondPool):
-                if pool.before_swap:
-                    pool.before_swap(
-                        pool,
-                        self.oracle[block_num],
-                        self.volatility[block_num],
-                        block_num,
-                    )
-
-    def retail_swap(self, block_num: int):
-        multi_pool_random_swap(self.liquidity_pools, self.oracle[block_num])
-
-    def after_swap(self, block_num: int):
-        for pool in self.liquidity_pools:
-            if isinstance(pool, DiamondPool):
-                if pool.after_swap:
-                    pool.after_swap(
-                        pool,
-                        self.oracle[block_num],
-                        self.volatility[block_num],
-                        block_num,
-                    )
-            else:
-                perform_arbitrage(pool, self.oracle[block_num], self.tx_fee_per_eth)
+        # Column views of the oracle; per-block price feeds are built from them on demand
+        self.px = self.oracle[:, Token.ETH]
+        self.py = self.oracle[:, Token.USDC]
+
+        # Retail flow of every simulated block, drawn in one batch instead of per block
+        self.retail_num_transactions, self.retail_sizes = draw_retail_flow(
+            len(self.oracle), self.rng
+        )
+
+    def price_feed(self, block_num: int) -> PriceFeed:
+        """
+        Get the oracle prices of one block as plain floats.
+
+        Args:
+            block_num (int): The block to read.
+
+        Returns:
+            PriceFeed: The price of each token at the block.
+        """
+        return PriceFeed(self.px.item(block_num), self.py.item(block_num))
+
+    def before_swap(self, block_num: int, price_feed: PriceFeed, volatility: float):
+        for pool in self._diamond_pools:
+            if pool.before_swap:
+                pool.before_swap(pool, price_feed, volatility, block_num)
+
+    def retail_swap(self, block_num: int, price_feed: PriceFeed):
+        multi_pool_random_swap(
+            self.liquidity_pools,
+            price_feed,
+            self.rng,
+            self.retail_num_transactions.item(block_num),
+            self.retail_sizes.item(block_num),
+        )
+
+    def after_swap(self, block_num: int, price_feed: PriceFeed, volatility: float):
+        # Each only touches its own pool
+        for pool in self._diamond_pools:
+            if pool.after_swap:
+                pool.after_swap(pool, price_feed, volatility, block_num)
+        for pool in self._plain_pools:
+            perform_arbitrage(pool, price_feed, self.tx_fee_per_eth)
 
     def run_block(self, block_num: int):
-        # Before Swaps
-        self.before_swap(block_num)
-        # Retail Swaps
-        self.retail_swap(block_num)
-        # After Swaps
-        self.after_swap(block_num)
+        # The block's prices are read once and shared by the three phases; the retail
+        # swaps pick among all pools, so every before-swap hook runs first
+        price_feed = self.price_feed(block_num)
+        volatility = self.volatility.item(block_num)
+
+        self.before_swap(block_num, price_feed, volatility)
+        self.retail_swap(block_num, price_feed)
+        self.after_swap(block_num, price_feed, volatility)
 
     def print_snapshot(self, block_num: int):
         print(f"Block {block_num}------------------------------------")
-        print("Oracle Price", self.oracle[block_num])
+        print("Oracle Price", self.price_feed(block_num))
         for pool_snapshot in self.current_snapshot():
             print(pool_snapshot)
 
+    def pool_arrays(self, pools: list[LiquidityPool]) -> PoolArrays:
+        """
+        Gather the pool and vault reserves of several pools into arrays, one entry per pool.
+
+        Args:
+            pools (list[LiquidityPool]): The pools to gather.
+
+        Returns:
+            PoolArrays: The reserves of each pool, in the order given.
+        """
+        arrays = PoolArrays(*np.empty((4, len(pools))))
+        for i, pool in enumerate(pools):
+            arrays.reserve_x[i] = pool.reserve_x
+            arrays.reserve_y[i] = pool.reserve_y
+            arrays.vault_x[i], arrays.vault_y[i] = pool.vault_reserves()
+        return arrays
+
+    def tvl_many(self, pools: list[LiquidityPool], block_num: int) -> np.ndarray:
+        """
+        Compute the total value locked of several pools at the oracle price of one block.
+
+        Args:
+            pools (list[LiquidityPool]): The pools to value.
+            block_num (int): The block whose oracle price is used.
+
+        Returns:
+            np.ndarray: The TVL of each pool, in the order given.
+        """
+        return self._tvl(self.pool_arrays(pools), block_num)
+
+    def _tvl(self, arrays: PoolArrays, block_num: int) -> np.ndarray:
+        return (arrays.reserve_x + arrays.vault_x) * self.px[block_num] + (
+            arrays.reserve_y + arrays.vault_y
+        ) * self.py[block_num]
+
     def current_snapshot(self):
         snapshot = []
-        for pool in self.liquidity_pools:
-            is_diamond = isinstance(pool, DiamondPool)
+        tvls = self.tvl_many(self.liquidity_pools, -1)
+        for pool, tvl in zip(self.liquidity_pools, tvls.tolist()):
             snapshot.append(
                 {
-                    "Type of Pool": "Diamond" if is_diamond else "Liquidity",
+                    "Type of Pool": pool.pool_type,
                     "Token_x Reserve": pool.reserve_x,
                     "Token_y Reserve": pool.reserve_y,
                     "Pool Price": pool.price,
-                    "TVL": pool.total_value_locked(self.oracle[-1]),
+                    "TVL": tvl,
                     "LVR": pool.lvr,
                     "Collected Fees": pool.collected_fees_retail
                     + pool.collected_fees_arbitrage,
@@ -171,27 +235,38 @@ class Simulator:
         if verbose:
             self.print_snapshot(0)
 
-        for block_num in range(self.blocks_per_day * self.num_days):
-            self.run_block(block_num)
+        # Loop invariants, bound to locals to skip attribute lookups per block
+        run_block = self.run_block
+        pools = self.liquidity_pools
+        total_blocks = self.blocks_per_day * self.num_days
+        last_block = total_blocks - 1
+        new_liquidity = self.new_liquidity
+        new_liquidity_period = self.new_liquidity_period
+        add_new_liquidity = new_liquidity > 0 and new_liquidity_period > 0
+
+        for block_num in range(total_blocks):
+            run_block(block_num)
 
             # if verbose and (block_num + 1) % self.blocks_per_day == 0:
-            if verbose and block_num == self.blocks_per_day * self.num_days - 1:
+            if verbose and block_num == last_block:
                 self.print_snapshot(block_num)
 
             if (
-                self.new_liquidity > 0
-                and self.new_liquidity_period > 0
-                and (block_num + 1) % self.new_liquidity_period == 0
+                add_new_liquidity
+                and (block_num + 1) % new_liquidity_period == 0
                 and block_num != 0
             ):
-                tvls = [
-                    pool.total_value_locked(self.oracle[block_num])
-                    for pool in self.liquidity_pools
-                ]
-                # Seperate the new liquidity proportionally to the TVL of each pool
-                for i, pool in enumerate(self.liquidity_pools):
-                    new_liquidity = self.new_liquidity * (tvls[i] / sum(tvls))
-                    new_reserve_x = new_liquidity / 2 / pool.price
-                    new_reserve_y = new_liquidity / 2
-                    pool.add_liquidity(pool.token_x, new_reserve_x)
-                    pool.add_liquidity(pool.token_y, new_reserve_y)
+                # Seperate the new liquidity proportionally to the TVL of each pool,
+                # computed for all pools at once from the gathered reserves
+                arrays = self.pool_arrays(pools)
+                tvls = self._tvl(arrays, block_num)
+                pool_liquidity = new_liquidity * (tvls / tvls.sum())
+                new_reserves_x = (
+                    pool_liquidity / 2 / (arrays.reserve_y / arrays.reserve_x)
+                )
+                new_reserves_y = pool_liquidity / 2
+                for pool, new_reserve_x, new_reserve_y in zip(
+                    pools, new_reserves_x.tolist(), new_reserves_y.tolist()
+                ):
+                    pool.reserve_x += new_reserve_x
+                    pool.reserve_y += new_reserve_y
@@ -3,101 +3,159 @@ from math import sqrt
 
 from custom_types import PriceFeed
 from pool import LiquidityPool
+from jit import njit
 
+# Quotes within this relative distance of the best one count as tied, so pools whose
+# reserves only differ by rounding noise still share a retail swap
+BEST_QUOTE_RTOL = 1e-12
 
-def generate_uninformed_transactions(num_transactions, retail_size):
+
+def generate_uninformed_transactions(num_transactions, retail_size, rng=np.random):
     """
-    Generate a list of uninformed transactions, each with a random swap size and direction.
+    Generate uninformed transactions, each with a random swap size and direction.
 
     Args:
     - num_transactions (int): The number of transactions to generate.
     - retail_size (float): The scale parameter for the exponential distribution to determine swap sizes.
+    - rng (np.random.Generator): The source of randomness, the global numpy random state by default.
 
     Returns:
-    - transactions (list of tuples): Each tuple represents a transaction with (swap_size, direction),
-      where direction is either 1 (A to B) or -1 (B to A).
+    - swap_sizes (np.ndarray): The swap size of each transaction.
+    - directions (np.ndarray): The direction of each transaction, either 1 (A to B) or -1 (B to A).
     """
     # Generate random swap sizes for each transaction
-    swap_sizes = np.random.exponential(scale=retail_size, size=num_transactions)
+    swap_sizes = rng.exponential(scale=retail_size, size=num_transactions)
 
     # Generate random directions for each transaction (1 for A to B, -1 for B to A)
-    directions = np.random.choice([1, -1], size=num_transactions)
+    directions = rng.choice([1, -1], size=num_transactions)
+
+    return swap_sizes, directions
+
+
+def draw_retail_flow(num_blocks, rng=np.random):
+    """
+    Draw the number of retail transactions and the retail size of every block at once.
 
-    # Combine swap sizes and directions into transactions
-    transactions = list(zip(swap_sizes, directions))
+    Args:
+        num_blocks (int): The number of blocks to draw for.
+        rng (np.random.Generator): The source of randomness, the global numpy random state by default.
 
-    return transactions
+    Returns:
+        num_transactions (np.ndarray): The number of retail transactions of each block.
+        retail_sizes (np.ndarray): The retail size of each block.
+    """
+    # Its a mean and std deviation of number of transactions and retail size of Uniswap V2 ETH/USDT pool in 2023/02~2024/02
+    num_transactions = np.round(rng.normal(1.2546, 0.5909, num_blocks)).astype(np.int64)
+    np.maximum(num_transactions, 0, out=num_transactions)
+    retail_sizes = rng.normal(1743, 6331, num_blocks)
+    np.maximum(retail_sizes, 0, out=retail_sizes)
+    return num_transactions, retail_sizes
 
 
-def multi_pool_random_swap(pools: list[LiquidityPool], price_feed: PriceFeed):
+def multi_pool_random_swap(
+    pools: list[LiquidityPool],
+    price_feed: PriceFeed,
+    rng=np.random,
+    num_transactions=None,
+    retail_size=None,
+):
     """
     Perform a random swap in the pool that offers the best price among multiple pools.
 
     Args:
         pools (list[LiquidityPool]): A list of liquidity pools to consider for the swap.
         price_feed (PriceFeed): The price feed for the pools.
+        rng (np.random.Generator): The source of randomness, the global numpy random state by default.
+        num_transactions (int, optional): The number of retail transactions, drawn from rng if not given.
+        retail_size (float, optional): The retail size, drawn from rng if not given.
     """
     if not pools:
         return  # No pools available
 
     token_x, token_y = pools[0].token_x, pools[0].token_y
-    target_price = price_feed[token_x] / price_feed[token_y]
+    px, py = price_feed[token_x], price_feed[token_y]
+    target_price = px / py
 
     # Generate Transactions
-    transactions = generate_uninformed_transactions(
-        max(round(np.random.normal(1.2546, 0.5909)), 0),
-        max(
-            np.random.normal(1743, 6331), 0
-        ),  # Its a mean and std deviation of number of transactions and retail size of Uniswap V2 ETH/USDT pool in 2023/02~2024/02
+    if num_transactions is None:
+        num_transactions = max(round(rng.normal(1.2546, 0.5909)), 0)
+    if retail_size is None:
+        retail_size = max(rng.normal(1743, 6331), 0)
+    if num_transactions == 0:
+        return  # No retail flow in this block
+    swap_sizes, directions = generate_uninformed_transactions(
+        num_transactions, retail_size, rng
+    )
+    if retail_size == 0:
+        return  # Every swap is empty; the draws above still advance rng as usual
+
+    # Quotes are all taken before any swap is applied, so quote every transaction
+    # against every pool at once: one row per transaction, one column per pool
+    reserves_x = np.array([pool.reserve_x for pool in pools])
+    reserves_y = np.array([pool.reserve_y for pool in pools])
+    fees = [pool.fee for pool in pools]
+    one_minus_fees = np.array([pool.one_minus_fee for pool in pools])
+
+    x_in = (directions > 0)[:, None]
+    amounts_in = np.where(x_in[:, 0], swap_sizes / target_price, swap_sizes)
+    reserves_in = np.where(x_in, reserves_x, reserves_y)
+    reserves_out = np.where(x_in, reserves_y, reserves_x)
+    amounts_in_with_fee = amounts_in[:, None] * one_minus_fees
+    amounts_out = (
+        amounts_in_with_fee * reserves_out / (reserves_in + amounts_in_with_fee)
+    )
+    is_best = amounts_out >= amounts_out.max(axis=1, keepdims=True) * (
+        1 - BEST_QUOTE_RTOL
     )
-    pending_swaps = []
-
-    for transaction in transactions:
-        swap_size, direction = transaction
-        # Find the pool with the best price for the swap
-        best_pools = []
-        best_amount_out = 0
-        for pool in pools:
-            amount_out = (
-                pool.get_amount_out(token_x, swap_size / target_price)
-                if direction == 1
-                else pool.get_amount_out(token_y, swap_size)
-            )
-            # Save the pool with the best price for the swap
-            if amount_out > best_amount_out:
-                best_amount_out = amount_out
-                best_pools = [pool]
-            # If the pool has the same price as the best price, add it to the list
-            elif amount_out == best_amount_out:
-                best_pools.append(pool)
-
-        # Split the swap size among the best pools
-        if best_pools:
-            split_swap_size = swap_size / len(best_pools)
-            for best_pool in best_pools:
-                pending_swaps.append((best_pool, split_swap_size, direction))
+
+    # Split the swap size among the pools with the best price for the swap; the
+    # pending swaps are kept as parallel arrays, in transaction then pool order
+    pending_tx, pending_pools = np.nonzero(is_best)
+    pending_sizes = (swap_sizes / is_best.sum(axis=1))[pending_tx]
+    pending_directions = directions[pending_tx]
 
     # # Print the swap details of the pending swaps in the liquidity pools
-    # print(
-    #     "Sum of Pending Swap Size in Liquidity Pools: ",
-    #     sum([swap[1] for swap in pending_swaps if isinstance(swap[0], LiquidityPool)]),
-    # )
-    # print(
-    #     "Sum of Pending Swap Size in Diamond Pools: ",
-    #     sum([swap[1] for swap in pending_swaps if isinstance(swap[0], DiamondPool)]),
+    # pool_tags = np.array([pool.pool_type == "Diamond" for pool in pools], dtype=int)
+    # swap_size_per_tag = np.bincount(
+    #     pool_tags[pending_pools], weights=pending_sizes, minlength=2
     # )
+    # print("Sum of Pending Swap Size in Liquidity Pools: ", swap_size_per_tag[0])
+    # print("Sum of Pending Swap Size in Diamond Pools: ", swap_size_per_tag[1])
 
-    for swap in pending_swaps:
-        pool, swap_size, direction = swap
+    for i, swap_size, direction in zip(
+        pending_pools.tolist(), pending_sizes.tolist(), pending_directions.tolist()
+    ):
+        pool = pools[i]
 
-        if direction == 1:
-            pool.swap(token_x, swap_size / target_price)
+        if direction > 0:
+            pool.swap_x_for_y(swap_size / target_price)
         else:
-            pool.swap(token_y, swap_size)
+            pool.swap_y_for_x(swap_size)
 
-        swap_fee = swap_size * price_feed[token_y] * pool.fee
-        pool.collected_fees_retail += swap_fee
-        pool.volume_retail += swap_size * price_feed[token_y]
+        swap_value = swap_size * py
+        pool.collected_fees_retail += swap_value * fees[i]
+        pool.volume_retail += swap_value
+
+
+@njit(cache=True, fastmath=True)
+def _arb_kernel(reserve_a, reserve_b, fee, true_price_token_a, true_price_token_b):
+    x_to_y = (reserve_a * true_price_token_a) / reserve_b < true_price_token_b
+
+    invariant = reserve_a * reserve_b
+    one_minus_fee = 1.0 - fee
+
+    numerator = invariant * (true_price_token_b if x_to_y else true_price_token_a)
+    denominator = (true_price_token_a if x_to_y else true_price_token_b) * one_minus_fee
+    left_side = sqrt(numerator / denominator)
+    right_side = (reserve_a if x_to_y else reserve_b) / one_minus_fee
+
+    if left_side < right_side:
+        return False, 0.0
+
+    # Compute the amount that must be sent to move the price to the profit-maximizing price
+    amount_in = left_side - right_side
+
+    return x_to_y, amount_in
 
 
 def compute_profit_maximizing_trade(
@@ -115,27 +173,61 @@ def compute_profit_maximizing_trade(
         x_to_y (bool): True if the trade is from token A to token B, False if from token B to token A.
         amount_in (float): The amount that must be sent to move the price to the profit-maximizing price.
     """
-    reserve_a, reserve_b = pool.reserve_x, pool.reserve_y
-    fee = pool.fee
+    return _arb_kernel(
+        pool.reserve_x,
+        pool.reserve_y,
+        pool.fee,
+        true_price_token_a,
+        true_price_token_b,
+    )
 
-    x_to_y = (reserve_a * true_price_token_a) / reserve_b < true_price_token_b
 
-    invariant = reserve_a * reserve_b
+# Only allow contracting multiply-adds into FMA instructions; unlike full fastmath
+# this keeps IEEE semantics for the profitability comparison
+@njit(cache=True, fastmath={"contract"})
+def _arbitrage_kernel(reserve_x, reserve_y, fee, price_x, price_y, tx_fee_per_eth):
+    """
+    Returns (executed, reserve_x, reserve_y, lvr, swap_fee, volume); the reserves are
+    unchanged when the arbitrage is not profitable.
+    """
+    target_price = price_x / price_y
+    tx_fee = tx_fee_per_eth * target_price
 
-    left_side = sqrt(
-        invariant
-        * (true_price_token_b if x_to_y else true_price_token_a)
-        / ((true_price_token_a if x_to_y else true_price_token_b) * (1 - fee))
-    )
-    right_side = (reserve_a if x_to_y else reserve_b) / (1 - fee)
+    # Compute the profit-maximizing trade
+    x_to_y, arb_amount = _arb_kernel(reserve_x, reserve_y, fee, price_x, price_y)
 
-    if left_side < right_side:
-        return False, 0
+    # Inside the no-arbitrage band there is nothing to gain, whatever the tx fee
+    if arb_amount == 0.0:
+        return False, reserve_x, reserve_y, 0.0, 0.0, 0.0
 
-    # Compute the amount that must be sent to move the price to the profit-maximizing price
-    amount_in = left_side - right_side
+    amount_in_with_fee = arb_amount * (1 - fee)
+    if x_to_y:
+        amount_out = amount_in_with_fee * reserve_y / (reserve_x + amount_in_with_fee)
+        delta_x = arb_amount
+        delta_y = -amount_out
+        swap_fee = arb_amount * price_x * fee
+    else:
+        amount_out = amount_in_with_fee * reserve_x / (reserve_y + amount_in_with_fee)
+        delta_x = -amount_out
+        delta_y = arb_amount
+        swap_fee = arb_amount * price_y * fee
 
-    return x_to_y, amount_in
+    lp_loss_vs_cex = -1 * (delta_x * price_x + delta_y * price_y) + swap_fee
+
+    arbitrageur_profit = lp_loss_vs_cex - swap_fee - tx_fee
+    if arbitrageur_profit <= 0:
+        return False, reserve_x, reserve_y, 0.0, 0.0, 0.0
+
+    if x_to_y:  # Arbitrageur sell token_x and buys token_y
+        reserve_x += arb_amount
+        reserve_y -= amount_out
+        volume = arb_amount * price_x
+    else:  # Arbitrageur sell token_y and buy token_x
+        reserve_y += arb_amount
+        reserve_x -= amount_out
+        volume = arb_amount * price_y
+
+    return True, reserve_x, reserve_y, lp_loss_vs_cex, swap_fee, volume
 
 
 def perform_arbitrage(
@@ -152,38 +244,30 @@ def perform_arbitrage(
         tx_fee_per_eth (float): The transaction fee per eth.
 
     """
-
-    token_x, token_y = pool.token_x, pool.token_y
-
-    target_price = price_feed[token_x] / price_feed[token_y]
-    tx_fee = tx_fee_per_eth * target_price
-
-    # Compute the profit-maximizing trade
-    x_to_y, arb_amount = compute_profit_maximizing_trade(
-        price_feed[token_x], price_feed[token_y], pool
+    (
+        executed,
+        reserve_x,
+        reserve_y,
+        lp_loss_vs_cex,
+        swap_fee,
+        volume,
+    ) = _arbitrage_kernel(
+        pool.reserve_x,
+        pool.reserve_y,
+        pool.fee,
+        price_feed[pool.token_x],
+        price_feed[pool.token_y],
+        tx_fee_per_eth,
     )
 
-    if x_to_y:
-        delta_x = arb_amount
-        delta_y = -pool.get_amount_out(token_x, arb_amount)
-        swap_fee = arb_amount * price_feed[token_x] * pool.fee
-    else:
-        delta_x = -pool.get_amount_out(token_y, arb_amount)
-        delta_y = arb_amount
-        swap_fee = arb_amount * price_feed[token_y] * pool.fee
-
-    lp_loss_vs_cex = (
-        -1 * (delta_x * price_feed[token_x] + delta_y * price_feed[token_y]) + swap_fee
-    )
-
-    arbitrageur_profit = lp_loss_vs_cex - swap_fee - tx_fee
-    if arbitrageur_profit > 0:
-        if x_to_y:  # Arbitrageur sell token_x and buys token_y
-            pool.swap(token_x, arb_amount)
-            pool.volume_arbitrage += arb_amount * price_feed[token_x]
-        else:  # Arbitrageur sell token_y and buy token_x
-            pool.swap(token_y, arb_amount)
-            pool.volume_arbitrage += arb_amount * price_feed[token_y]
+    if executed:
+        pool.reserve_x = reserve_x
+        pool.reserve_y = reserve_y
 
+        pool.volume_arbitrage += volume
         pool.lvr += lp_loss_vs_cex  # account without swap fees and tx fees
         pool.collected_fees_arbitrage += swap_fee
+
+
+_arb_kernel(1.0, 1.0, 0.003, 1.0, 1.0)
+_arbitrage_kernel(1.0, 1.0, 0.003, 1.0, 1.0, 0.0)